@@ -0,0 +1,39 @@
+"""
+Shared pytest fixtures for the Shadowcat MCP validator tests.
+"""
+
+import os
+from pathlib import Path
+
+import pytest
+
+PROJECT_ROOT = Path(__file__).resolve().parents[2]
+
+# Release build of the shadowcat submodule, resolved once
+SHADOWCAT = PROJECT_ROOT / "shadowcat/target/release/shadowcat"
+
+# Reference stdio server from the mcp-validator submodule, resolved once
+REF_SERVER = PROJECT_ROOT / "tools/mcp-validator/ref_stdio_server/stdio_server_2025_03_26.py"
+
+# Set SHADOWCAT_REQUIRE_PROXY=1 (run-compliance-test.sh does) to fail
+# rather than skip when the proxy or its prerequisites are missing
+REQUIRE_PROXY = bool(os.environ.get("SHADOWCAT_REQUIRE_PROXY"))
+
+@pytest.fixture(scope="session")
+def unavailable():
+    """Skip for a missing prerequisite, or fail under SHADOWCAT_REQUIRE_PROXY."""
+    return pytest.fail if REQUIRE_PROXY else pytest.skip
+
+@pytest.fixture(scope="session")
+def shadowcat_path(unavailable) -> Path:
+    """Path to the release Shadowcat binary; skips if it hasn't been built."""
+    if not SHADOWCAT.exists():
+        unavailable(f"Shadowcat not found at {SHADOWCAT}")
+    return SHADOWCAT
+
+@pytest.fixture(scope="session")
+def ref_server_path(unavailable) -> Path:
+    """Path to the reference stdio server; skips if the submodule is missing."""
+    if not REF_SERVER.exists():
+        unavailable(f"Reference server not found at {REF_SERVER}")
+    return REF_SERVER
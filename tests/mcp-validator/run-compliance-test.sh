@@ -24,6 +24,10 @@ else
     source .venv/bin/activate
 fi
 
+# Dependencies of our own tests; installed on every run so an existing
+# venv picks them up too
+uv pip install orjson httpx pytest pytest-xdist
+
 # Check if reference server is running
 if ! curl -s http://localhost:8088/ > /dev/null 2>&1; then
     echo "Starting MCP reference server..."
@@ -49,11 +53,13 @@ else
     echo "Shadowcat proxy already running"
 fi
 
-# Run our compliance test
+# Run our compliance and stdio proxy tests (one xdist worker per file;
+# -rP shows the captured probe report on passing runs too). Require the
+# proxy so a failed startup fails the run instead of skipping every test.
 echo ""
 echo "Running compliance test..."
 cd "$SCRIPT_DIR"
-python test_shadowcat_compliance.py
+SHADOWCAT_REQUIRE_PROXY=1 python -m pytest -v -rP --dist=loadfile --tx 2*popen
 
 # Cleanup (optional - uncomment to auto-cleanup)
 # if [ ! -z "$SERVER_PID" ]; then
@@ -2,41 +2,94 @@
 """
 Simple compliance test for Shadowcat proxy.
 Tests basic MCP operations through the proxy.
+
+Expects a Shadowcat reverse proxy on localhost:8089 (see
+run-compliance-test.sh) and skips if none is listening, or fails with
+SHADOWCAT_REQUIRE_PROXY=1 as the script sets. Run with:
+    pytest -rP tests/mcp-validator
+
+The probe report is printed while the results fixture runs, so pytest
+captures it: -rP shows it on passing runs, and failing tests carry their
+probe's output in the assertion message.
 """
 
-import json
-import requests
-from typing import Dict, Any
+import asyncio
+import httpx
+import orjson
+import pytest
+import sys
+from typing import Dict, Any, List, Optional, Tuple
 
 # Configuration
-PROXY_URL = "http://localhost:8089/mcp"
+BASE_URL = "http://localhost:8089"
+PROXY_PATH = "/mcp"
+PROXY_URL = BASE_URL + PROXY_PATH
 # AUTH_TOKEN is handled by the proxy via env var or file, not passed from client
 
-def test_initialize() -> Dict[str, Any]:
-    """Test initialization."""
-    print("Testing: Initialize...")
-    
-    request = {
-        "jsonrpc": "2.0",
-        "id": 1,
-        "method": "initialize",
-        "params": {
-            "protocolVersion": "2025-03-26",
-            "clientInfo": {"name": "compliance-test", "version": "1.0"},
-            "capabilities": {},
-            "clientCapabilities": {"protocol_versions": ["2025-03-26"]}
-        }
+# Request envelopes are immutable, so encode them once at import time
+_INITIALIZE_REQUEST = orjson.dumps({
+    "jsonrpc": "2.0",
+    "id": 1,
+    "method": "initialize",
+    "params": {
+        "protocolVersion": "2025-03-26",
+        "clientInfo": {"name": "compliance-test", "version": "1.0"},
+        "capabilities": {},
+        "clientCapabilities": {"protocol_versions": ["2025-03-26"]}
+    }
+})
+_TOOLS_LIST_REQUEST = orjson.dumps({
+    "jsonrpc": "2.0",
+    "id": 2,
+    "method": "tools/list",
+    "params": {}
+})
+_TOOL_CALL_REQUEST = orjson.dumps({
+    "jsonrpc": "2.0",
+    "id": 3,
+    "method": "tools/call",
+    "params": {
+        "name": "echo",
+        "arguments": {"message": "Hello from Shadowcat compliance test!"}
     }
+})
+# Invalid method (include id to get error response)
+_INVALID_METHOD_REQUEST = orjson.dumps({
+    "jsonrpc": "2.0",
+    "id": 999,
+    "method": "invalid_method",
+    "params": {}
+})
+
+def make_skeleton(method: str, params: Dict[str, Any]) -> Tuple[bytes, bytes]:
+    """Pre-encode a request as the (prefix, suffix) around its id.
     
-    response = requests.post(
-        PROXY_URL,
-        json=request,
-        headers={
-            "Content-Type": "application/json"
-        }
+    Joining the halves around an encoded id yields the full request, so a
+    caller issuing many of them never builds a dict or runs the encoder.
+    """
+    return (
+        b'{"jsonrpc":"2.0","id":',
+        b',"method":' + orjson.dumps(method) + b',"params":' + orjson.dumps(params) + b'}',
     )
+
+PING_ID = 4
+_PING_PREFIX, _PING_SUFFIX = make_skeleton("ping", {})
+
+def ping_request(request_id: int) -> bytes:
+    """Encode a ping request; only the id is formatted per call."""
+    return _PING_PREFIX + str(request_id).encode() + _PING_SUFFIX
+
+async def _post(client: httpx.AsyncClient, payload: bytes, session_id: Optional[str] = None) -> Dict[str, Any]:
+    """POST an encoded JSON-RPC request to the proxy and decode the reply."""
+    headers = {"Mcp-Session-Id": session_id} if session_id else None
+    response = await client.post(PROXY_PATH, content=payload, headers=headers)
+    return orjson.loads(response.content)
+
+async def probe_initialize(client: httpx.AsyncClient) -> Dict[str, Any]:
+    """Test initialization."""
+    print("Testing: Initialize...")
     
-    result = response.json()
+    result = await _post(client, _INITIALIZE_REQUEST)
     
     if "result" in result:
         session_id = result["result"].get("sessionId")
@@ -46,165 +99,172 @@ def test_initialize() -> Dict[str, Any]:
         print(f"❌ Initialize: Failed - {result.get('error', 'Unknown error')}")
         return {"status": "fail", "error": result.get("error")}
 
-def test_tools_list(session_id: str) -> Dict[str, Any]:
-    """Test tools/list."""
-    print("Testing: Tools List...")
-    
-    request = {
-        "jsonrpc": "2.0",
-        "id": 2,
-        "method": "tools/list",
-        "params": {}
-    }
-    
-    response = requests.post(
-        PROXY_URL,
-        json=request,
-        headers={
-            "Content-Type": "application/json",
-            "Mcp-Session-Id": session_id
-        }
-    )
-    
-    result = response.json()
+def _check_tools_list(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Check a tools/list reply."""
+    output = ["Testing: Tools List..."]
     
     if "result" in result:
         tools = result["result"].get("tools", [])
-        print(f"✅ Tools List: {len(tools)} tools found")
-        for tool in tools:
-            print(f"   - {tool['name']}: {tool.get('description', 'No description')}")
-        return {"status": "pass", "tools": tools}
+        output.append(f"✅ Tools List: {len(tools)} tools found")
+        output.extend(
+            f"   - {tool['name']}: {tool.get('description', 'No description')}"
+            for tool in tools
+        )
+        return {"status": "pass", "tools": tools, "output": output}
     else:
-        print(f"❌ Tools List: Failed - {result.get('error', 'Unknown error')}")
-        return {"status": "fail", "error": result.get("error")}
+        output.append(f"❌ Tools List: Failed - {result.get('error', 'Unknown error')}")
+        return {"status": "fail", "error": result.get("error"), "output": output}
 
-def test_tool_call(session_id: str) -> Dict[str, Any]:
-    """Test calling a tool."""
-    print("Testing: Tool Call (echo)...")
-    
-    request = {
-        "jsonrpc": "2.0",
-        "id": 3,
-        "method": "tools/call",
-        "params": {
-            "name": "echo",
-            "arguments": {"message": "Hello from Shadowcat compliance test!"}
-        }
-    }
-    
-    response = requests.post(
-        PROXY_URL,
-        json=request,
-        headers={
-            "Content-Type": "application/json",
-            "Mcp-Session-Id": session_id
-        }
-    )
-    
-    result = response.json()
+async def probe_tools_list(client: httpx.AsyncClient, session_id: str) -> Dict[str, Any]:
+    """Test tools/list."""
+    return _check_tools_list(await _post(client, _TOOLS_LIST_REQUEST, session_id))
+
+def _check_tool_call(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Check an echo tools/call reply."""
+    output = ["Testing: Tool Call (echo)..."]
     
     if "result" in result:
         text = result["result"].get("text", "")
-        print(f"✅ Tool Call: Success - Response: {text}")
-        return {"status": "pass", "response": text}
+        output.append(f"✅ Tool Call: Success - Response: {text}")
+        return {"status": "pass", "response": text, "output": output}
     else:
-        print(f"❌ Tool Call: Failed - {result.get('error', 'Unknown error')}")
-        return {"status": "fail", "error": result.get("error")}
+        output.append(f"❌ Tool Call: Failed - {result.get('error', 'Unknown error')}")
+        return {"status": "fail", "error": result.get("error"), "output": output}
 
-def test_ping(session_id: str) -> Dict[str, Any]:
-    """Test ping."""
-    print("Testing: Ping...")
-    
-    request = {
-        "jsonrpc": "2.0",
-        "id": 4,
-        "method": "ping",
-        "params": {}
-    }
-    
-    response = requests.post(
-        PROXY_URL,
-        json=request,
-        headers={
-            "Content-Type": "application/json",
-            "Mcp-Session-Id": session_id
-        }
-    )
-    
-    result = response.json()
+async def probe_tool_call(client: httpx.AsyncClient, session_id: str) -> Dict[str, Any]:
+    """Test calling a tool."""
+    return _check_tool_call(await _post(client, _TOOL_CALL_REQUEST, session_id))
+
+def _check_ping(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Check a ping reply."""
+    output = ["Testing: Ping..."]
     
     if "result" in result:
-        print(f"✅ Ping: Success")
-        return {"status": "pass"}
+        output.append(f"✅ Ping: Success")
+        return {"status": "pass", "output": output}
     else:
-        print(f"❌ Ping: Failed - {result.get('error', 'Unknown error')}")
-        return {"status": "fail", "error": result.get("error")}
+        output.append(f"❌ Ping: Failed - {result.get('error', 'Unknown error')}")
+        return {"status": "fail", "error": result.get("error"), "output": output}
 
-def test_error_handling(session_id: str) -> Dict[str, Any]:
-    """Test error handling."""
-    print("Testing: Error Handling...")
-    
-    # Send request with invalid method (include id to get error response)
-    request = {
-        "jsonrpc": "2.0",
-        "id": 999,
-        "method": "invalid_method",
-        "params": {}
-    }
-    
-    response = requests.post(
-        PROXY_URL,
-        json=request,
-        headers={
-            "Content-Type": "application/json",
-            "Mcp-Session-Id": session_id
-        }
-    )
-    
-    result = response.json()
+async def probe_ping(client: httpx.AsyncClient, session_id: str) -> Dict[str, Any]:
+    """Test ping."""
+    return _check_ping(await _post(client, ping_request(PING_ID), session_id))
+
+def _check_error_handling(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Check the reply to an unknown method."""
+    output = ["Testing: Error Handling..."]
     
     if "error" in result:
         error_code = result["error"].get("code")
-        print(f"✅ Error Handling: Correctly returned error (code: {error_code})")
-        return {"status": "pass", "error_code": error_code}
+        output.append(f"✅ Error Handling: Correctly returned error (code: {error_code})")
+        return {"status": "pass", "error_code": error_code, "output": output}
     else:
-        print(f"❌ Error Handling: Should have returned an error")
-        return {"status": "fail"}
+        output.append(f"❌ Error Handling: Should have returned an error")
+        return {"status": "fail", "output": output}
 
-def main():
-    print("=" * 60)
-    print("Shadowcat MCP Compliance Test")
-    print("=" * 60)
-    print(f"Testing proxy at: {PROXY_URL}")
-    print()
-    
-    # Test 1: Initialize
-    init_result = test_initialize()
-    if init_result["status"] != "pass":
-        print("\nCannot continue without successful initialization")
-        return
+async def probe_error_handling(client: httpx.AsyncClient, session_id: str) -> Dict[str, Any]:
+    """Test error handling."""
+    return _check_error_handling(await _post(client, _INVALID_METHOD_REQUEST, session_id))
+
+async def run_batch(client: httpx.AsyncClient, session_id: str) -> Optional[List[Dict[str, Any]]]:
+    """Send tests 2-5 as a single JSON-RPC batch and check each reply.
     
-    session_id = init_result["session_id"]
-    print(f"\nUsing session: {session_id}\n")
+    Returns None if the proxy doesn't answer with a reply for every request.
+    """
+    probes = [
+        (2, _TOOLS_LIST_REQUEST, _check_tools_list),
+        (3, _TOOL_CALL_REQUEST, _check_tool_call),
+        (PING_ID, ping_request(PING_ID), _check_ping),
+        (999, _INVALID_METHOD_REQUEST, _check_error_handling),
+    ]
+    payload = b"[" + b",".join(request for _, request, _ in probes) + b"]"
+    response = await client.post(PROXY_PATH, content=payload, headers={"Mcp-Session-Id": session_id})
     
-    # Test 2: Tools List
-    test_tools_list(session_id)
-    print()
+    try:
+        replies = orjson.loads(response.content)
+    except orjson.JSONDecodeError:
+        return None
+    if not isinstance(replies, list):
+        return None
     
-    # Test 3: Tool Call
-    test_tool_call(session_id)
-    print()
+    by_id = {reply.get("id"): reply for reply in replies if isinstance(reply, dict)}
+    if any(request_id not in by_id for request_id, _, _ in probes):
+        return None
+    return [check(by_id[request_id]) for request_id, _, check in probes]
+
+# Probes that run once a session exists, in report order
+PROBE_NAMES = ["tools_list", "tool_call", "ping", "error_handling"]
+
+async def run_all() -> Dict[str, Dict[str, Any]]:
+    """Initialize a session, then run the remaining probes together.
     
-    # Test 4: Ping
-    test_ping(session_id)
-    print()
+    Returns each probe's result by name; only "initialize" is present if
+    initialization fails.
+    """
+    print(f"Testing proxy at: {PROXY_URL}")
+    # HTTP/1.1 keep-alive: httpx only negotiates HTTP/2 over TLS, and the
+    # proxy endpoint is cleartext
+    async with httpx.AsyncClient(
+        base_url=BASE_URL,
+        # httpx sends no Content-Type for raw `content=` bytes, and the proxy
+        # rejects POSTs that aren't application/json
+        headers={"Content-Type": "application/json"},
+    ) as client:
+        # Test 1: Initialize
+        init_result = await probe_initialize(client)
+        if init_result["status"] != "pass":
+            return {"initialize": init_result}
+        
+        session_id = init_result["session_id"]
+        print(f"\nUsing session: {session_id}\n")
+        
+        # Tests 2-5 only depend on the session: send them as one batch, or
+        # concurrently if the proxy doesn't support JSON-RPC batching
+        results = await run_batch(client, session_id)
+        if results is None:
+            results = await asyncio.gather(
+                probe_tools_list(client, session_id),
+                probe_tool_call(client, session_id),
+                probe_ping(client, session_id),
+                probe_error_handling(client, session_id),
+            )
     
-    # Test 5: Error Handling
-    test_error_handling(session_id)
+    # Report in a stable order regardless of completion order, with a
+    # single write instead of one per line
+    report = "\n\n".join("\n".join(result["output"]) for result in results)
+    sys.stdout.write(report + "\n")
+    sys.stdout.flush()
     
-    print("\n" + "=" * 60)
-    print("Compliance Test Complete")
-    print("=" * 60)
+    return {"initialize": init_result, **dict(zip(PROBE_NAMES, results))}
+
+@pytest.fixture(scope="module")
+def results(unavailable) -> Dict[str, Dict[str, Any]]:
+    """Run every probe against the proxy once for the whole module."""
+    try:
+        return asyncio.run(run_all())
+    except httpx.ConnectError:
+        pass
+    # Outside the except block, so a strict-mode failure isn't chained to
+    # the connection traceback
+    unavailable(f"No Shadowcat proxy listening at {PROXY_URL}")
+
+def _assert_passed(results: Dict[str, Dict[str, Any]], name: str) -> None:
+    if name not in results:
+        pytest.fail("Cannot continue without successful initialization")
+    result = results[name]
+    assert result["status"] == "pass", result.get("error") or "\n".join(result.get("output", []))
+
+def test_initialize(results):
+    _assert_passed(results, "initialize")
+
+def test_tools_list(results):
+    _assert_passed(results, "tools_list")
+
+def test_tool_call(results):
+    _assert_passed(results, "tool_call")
+
+def test_ping(results):
+    _assert_passed(results, "ping")
 
-if __name__ == "__main__":
-    main()
\ No newline at end of file
+def test_error_handling(results):
+    _assert_passed(results, "error_handling")
@@ -1,222 +1,257 @@
 #!/usr/bin/env python3
 """
 Quick test to verify Shadowcat correctly proxies MCP messages.
+
+Run with (under xdist, --dist=loadfile keeps this module, and so its
+shared proxy, on one worker):
+    pytest tests/mcp-validator/test_shadowcat_proxy.py
+    pytest --dist=loadfile --tx 2*popen tests/mcp-validator
 """
 
-import json
+import fcntl
+import os
+import select
 import subprocess
-import sys
 import time
-from pathlib import Path
 
-def test_direct_server():
-    """Test the reference server directly first."""
-    print("Testing reference server directly...")
-    
-    # Start the reference server
-    server = subprocess.Popen(
-        ["python", "ref_stdio_server/stdio_server_2025_03_26.py"],
-        stdin=subprocess.PIPE,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True
-    )
-    
-    # Send initialize request
-    request = {
-        "jsonrpc": "2.0",
-        "id": 1,
-        "method": "initialize",
-        "params": {
-            "protocolVersion": "2025-03-26",
-            "clientInfo": {"name": "test-client", "version": "1.0"},
-            "capabilities": {}
-        }
+import orjson
+import pytest
+
+# Set SHADOWCAT_TEST_DEBUG=1 to dump every decoded message
+DEBUG = bool(os.environ.get("SHADOWCAT_TEST_DEBUG"))
+
+# Bytes per os.read on a pipe fd, and kernel pipe capacity to request on
+# Linux so large tool responses don't stall the writer
+READ_CHUNK = 64 * 1024
+PIPE_CAPACITY = 1024 * 1024
+
+def _grow_pipes(proc):
+    """Raise the kernel capacity of proc's stdio pipes where supported."""
+    set_pipe_size = getattr(fcntl, "F_SETPIPE_SZ", None)
+    if set_pipe_size is None:
+        return
+    for pipe in (proc.stdin, proc.stdout):
+        try:
+            fcntl.fcntl(pipe.fileno(), set_pipe_size, PIPE_CAPACITY)
+        except OSError:
+            # Capped by /proc/sys/fs/pipe-max-size; keep the default
+            pass
+
+def _debug_json(label, message):
+    """Pretty-print a decoded message, only when DEBUG is on."""
+    if DEBUG:
+        print(f"{label}: {orjson.dumps(message, option=orjson.OPT_INDENT_2).decode()}")
+
+def _debug_preview(label, line, limit=100):
+    """Print the start of a raw message line, only when DEBUG is on."""
+    if DEBUG:
+        # Slice through a memoryview so only the preview is copied and decoded
+        preview = memoryview(line)[:limit].tobytes().decode("utf-8", "replace").rstrip("\n")
+        print(f"{label}: {preview}...")
+
+# Requests are fixed, so encode them (with their newline framing) once
+_INITIALIZE_REQUEST = orjson.dumps({
+    "jsonrpc": "2.0",
+    "id": 1,
+    "method": "initialize",
+    "params": {
+        "protocolVersion": "2025-03-26",
+        "clientInfo": {"name": "test-client", "version": "1.0"},
+        "capabilities": {}
     }
-    
-    server.stdin.write(json.dumps(request) + "\n")
-    server.stdin.flush()
-    
-    # Read response
-    response_line = server.stdout.readline()
-    if response_line:
-        response = json.loads(response_line)
-        print(f"Direct response: {json.dumps(response, indent=2)}")
-        assert response.get("result") is not None, "Expected result in response"
-        print("✅ Direct server test passed!")
-    else:
-        print("❌ No response from server")
-        
-    server.terminate()
-    server.wait()
-
-def test_shadowcat_proxy():
-    """Test through Shadowcat forward proxy."""
-    print("\nTesting through Shadowcat proxy...")
-    
-    shadowcat_path = Path("../../shadowcat/target/release/shadowcat")
-    if not shadowcat_path.exists():
-        print(f"❌ Shadowcat not found at {shadowcat_path}")
-        return False
-    
-    # Start Shadowcat as forward proxy
-    proxy = subprocess.Popen(
+}) + b"\n"
+ECHO_MESSAGE = "Hello from Shadowcat!"
+_TOOL_CALL_REQUEST = orjson.dumps({
+    "jsonrpc": "2.0",
+    "id": 2,
+    "method": "tools/call",
+    "params": {
+        "name": "echo",
+        "arguments": {"message": ECHO_MESSAGE}
+    }
+}) + b"\n"
+
+class StdioChannel:
+    """Newline-delimited JSON-RPC over a child's raw stdin/stdout fds.
+
+    Goes straight to os.write/os.read, skipping the buffered file objects
+    Popen wraps around the pipes. readline waits on stdout and stderr in
+    one select loop: stderr is collected into `stderr` so a chatty child
+    can't stall on a full pipe, child exit shows up as EOF, and the timeout
+    bounds the whole wait.
+    """
+
+    def __init__(self, proc):
+        self.proc = proc
+        self.stdin_fd = proc.stdin.fileno()
+        self.stdout_fd = proc.stdout.fileno()
+        self.stderr = bytearray()
+        self._stderr_fd = proc.stderr.fileno()
+        self._buffer = bytearray()
+        # Bytes of _buffer already searched for a newline
+        self._scanned = 0
+
+    def _drain_stderr(self):
+        """Collect whatever the child has written to stderr so far."""
+        while self._stderr_fd is not None:
+            readable, _, _ = select.select([self._stderr_fd], [], [], 0)
+            if not readable:
+                return
+            chunk = os.read(self._stderr_fd, READ_CHUNK)
+            if not chunk:
+                self._stderr_fd = None
+                return
+            self.stderr += chunk
+
+    def send(self, payload):
+        """Write an encoded message, retrying on short writes."""
+        view = memoryview(payload)
+        try:
+            while view:
+                view = view[os.write(self.stdin_fd, view):]
+        except BrokenPipeError:
+            self._drain_stderr()
+            pytest.fail(f"Child closed its stdin\nStderr: {self.stderr.decode(errors='replace')}")
+
+    def readline(self, timeout=5.0):
+        """Return the next line, or b"" if the child closed stdout first."""
+        deadline = time.monotonic() + timeout
+        while True:
+            # Resume the newline search where the last one stopped, so each
+            # byte of a large message is only scanned once
+            end = self._buffer.find(b"\n", self._scanned)
+            if end >= 0:
+                line = bytes(self._buffer[:end + 1])
+                del self._buffer[:end + 1]
+                self._scanned = 0
+                return line
+            self._scanned = len(self._buffer)
+            remaining = deadline - time.monotonic()
+            watched = [self.stdout_fd]
+            if self._stderr_fd is not None:
+                watched.append(self._stderr_fd)
+            readable, _, _ = select.select(watched, [], [], max(remaining, 0))
+            if not readable:
+                self._drain_stderr()
+                pytest.fail(
+                    f"No output from child within {timeout}s\n"
+                    f"Stderr: {self.stderr.decode(errors='replace')}"
+                )
+            if self._stderr_fd in readable:
+                self._drain_stderr()
+            if self.stdout_fd not in readable:
+                continue
+            chunk = os.read(self.stdout_fd, READ_CHUNK)
+            if not chunk:
+                self._drain_stderr()
+                line = bytes(self._buffer)
+                self._buffer.clear()
+                self._scanned = 0
+                return line
+            self._buffer += chunk
+
+@pytest.fixture(scope="session")
+def proxy(shadowcat_path, ref_server_path):
+    """Shadowcat forward proxy in front of the reference stdio server.
+
+    Spawned and initialized once, then shared by every test, so process
+    startup is paid once per session (per worker under xdist). Yields the
+    channel together with the raw initialize reply.
+    """
+    # Leaving the with block closes the pipes and waits for the process
+    with subprocess.Popen(
         [
             str(shadowcat_path),
             "--log-level", "error",
             "forward",
             "stdio",
             "--",
-            "python", str(Path("ref_stdio_server/stdio_server_2025_03_26.py").absolute())
+            "python", str(ref_server_path)
         ],
         stdin=subprocess.PIPE,
         stdout=subprocess.PIPE,
         stderr=subprocess.PIPE,
-        text=True
-    )
-    
-    # Give it a moment to start
-    time.sleep(1.0)
-    
-    # Check if proxy started OK
-    if proxy.poll() is not None:
-        print("❌ Proxy exited immediately")
-        stderr = proxy.stderr.read()
-        if stderr:
-            print(f"Stderr: {stderr}")
-        return False
-    
-    # Send initialize request through proxy
-    request = {
-        "jsonrpc": "2.0",
-        "id": 1,
-        "method": "initialize",
-        "params": {
-            "protocolVersion": "2025-03-26",
-            "clientInfo": {"name": "test-client", "version": "1.0"},
-            "capabilities": {}
-        }
-    }
-    
-    proxy.stdin.write(json.dumps(request) + "\n")
-    proxy.stdin.flush()
-    
-    # Read response
-    response_line = proxy.stdout.readline()
-    if response_line:
-        print(f"Raw response: {repr(response_line)}")
-        if not response_line.strip():
-            print("❌ Empty response from proxy")
+        # --log-level keeps logs off the JSON-RPC stdout stream; RUST_LOG
+        # also quiets any EnvFilter that reads the environment
+        env={**os.environ, "RUST_LOG": "error"}
+    ) as proxy:
+        try:
+            _grow_pipes(proxy)
+            channel = StdioChannel(proxy)
+
+            # The initialize reply doubles as the readiness signal
+            channel.send(_INITIALIZE_REQUEST)
+            init_response = channel.readline()
+
+            yield channel, init_response
+        finally:
+            # Also runs if setup fails, so a broken proxy isn't left running
+            # for the rest of the session
             proxy.terminate()
-            proxy.wait()
-            return False
-        response = json.loads(response_line)
-        print(f"Proxy response: {json.dumps(response, indent=2)}")
-        assert response.get("result") is not None, "Expected result in response"
-        print("✅ Shadowcat proxy test passed!")
-        success = True
-    else:
-        print("❌ No response through proxy")
+
+def test_direct_server(ref_server_path):
+    """Test the reference server directly first."""
+    print("Testing reference server directly...")
+
+    # Start the reference server
+    with subprocess.Popen(
+        ["python", str(ref_server_path)],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    ) as server:
+        _grow_pipes(server)
+        channel = StdioChannel(server)
+
+        try:
+            channel.send(_INITIALIZE_REQUEST)
+
+            # Read response
+            response_line = channel.readline()
+            assert response_line, "No response from server"
+            response = orjson.loads(response_line)
+            _debug_json("Direct response", response)
+            assert response.get("result") is not None, "Expected result in response"
+            print("✅ Direct server test passed!")
+        finally:
+            server.terminate()
+
+def test_shadowcat_proxy(proxy):
+    """Test through Shadowcat forward proxy."""
+    print("\nTesting through Shadowcat proxy...")
+
+    # The fixture sent initialize through the proxy; check its reply
+    channel, response_line = proxy
+    if not response_line:
         # Check stderr for errors
-        stderr = proxy.stderr.read()
-        if stderr:
-            print(f"Proxy stderr: {stderr}")
-        success = False
-        
-    proxy.terminate()
-    proxy.wait()
-    return success
-
-def test_tool_invocation():
+        pytest.fail(f"No response through proxy\nProxy stderr: {channel.stderr.decode(errors='replace')}")
+
+    if DEBUG:
+        print(f"Raw response: {repr(response_line)}")
+    assert response_line.strip(), "Empty response from proxy"
+    response = orjson.loads(response_line)
+    _debug_json("Proxy response", response)
+    assert response.get("result") is not None, "Expected result in response"
+    print("✅ Shadowcat proxy test passed!")
+
+def test_tool_invocation(proxy):
     """Test tool invocation through proxy."""
     print("\nTesting tool invocation through Shadowcat...")
-    
-    shadowcat_path = Path("../../shadowcat/target/release/shadowcat")
-    
-    # Start Shadowcat as forward proxy
-    proxy = subprocess.Popen(
-        [
-            str(shadowcat_path),
-            "--log-level", "error",
-            "forward",
-            "stdio",
-            "--",
-            "python", str(Path("ref_stdio_server/stdio_server_2025_03_26.py").absolute())
-        ],
-        stdin=subprocess.PIPE,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True
-    )
-    
-    time.sleep(0.5)
-    
-    # Initialize first
-    init_request = {
-        "jsonrpc": "2.0",
-        "id": 1,
-        "method": "initialize",
-        "params": {
-            "protocolVersion": "2025-03-26",
-            "clientInfo": {"name": "test-client", "version": "1.0"},
-            "capabilities": {}
-        }
-    }
-    
-    proxy.stdin.write(json.dumps(init_request) + "\n")
-    proxy.stdin.flush()
-    init_response = proxy.stdout.readline()
-    print(f"Init response: {init_response[:100]}...")
-    
+
+    # The shared proxy is already initialized
+    channel, init_response = proxy
+    if not init_response:
+        pytest.fail(f"No initialize response through proxy\nProxy stderr: {channel.stderr.decode(errors='replace')}")
+    _debug_preview("Init response", init_response)
+
     # Now test echo tool
-    tool_request = {
-        "jsonrpc": "2.0",
-        "id": 2,
-        "method": "tools/call",
-        "params": {
-            "name": "echo",
-            "arguments": {"message": "Hello from Shadowcat!"}
-        }
-    }
-    
-    proxy.stdin.write(json.dumps(tool_request) + "\n")
-    proxy.stdin.flush()
-    
-    tool_response_line = proxy.stdout.readline()
-    if tool_response_line:
-        tool_response = json.loads(tool_response_line)
-        print(f"Tool response: {json.dumps(tool_response, indent=2)}")
-        
-        result = tool_response.get("result")
-        if result and result.get("text") == "Hello from Shadowcat!":
-            print("✅ Tool invocation test passed!")
-            success = True
-        else:
-            print("❌ Tool response incorrect")
-            success = False
-    else:
-        print("❌ No tool response")
-        success = False
-    
-    proxy.terminate()
-    proxy.wait()
-    return success
-
-if __name__ == "__main__":
-    print("=" * 60)
-    print("Testing Shadowcat MCP Proxy Capabilities")
-    print("=" * 60)
-    
-    # Test 1: Direct server
-    test_direct_server()
-    
-    # Test 2: Through proxy
-    proxy_ok = test_shadowcat_proxy()
-    
-    # Test 3: Tool invocation
-    if proxy_ok:
-        test_tool_invocation()
-    
-    print("\n" + "=" * 60)
-    print("Test Summary")
-    print("=" * 60)
\ No newline at end of file
+    channel.send(_TOOL_CALL_REQUEST)
+
+    tool_response_line = channel.readline()
+    assert tool_response_line, "No tool response"
+    tool_response = orjson.loads(tool_response_line)
+    _debug_json("Tool response", tool_response)
+
+    result = tool_response.get("result")
+    assert result and result.get("text") == ECHO_MESSAGE, "Tool response incorrect"
+    print("✅ Tool invocation test passed!")